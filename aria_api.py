@@ -2,20 +2,40 @@
 # ARIA Local API — receives emails from Power Automate, analyzes with Claude
 
 import anthropic
-import sqlite3
-import json
+import asyncio
+import httpx
+import importlib.util
+import orjson
 import os
+import queue
+import threading
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 import uvicorn
 
-app = FastAPI(title="ARIA Email Agent", version="1.0")
-
-DB_PATH = r"C:\Users\MXDELACEGA\OneDrive - NESTLE\GitHub\ARIA-AI-Agent\aria.db"
-
-client = anthropic.Anthropic(
-    api_key=os.environ.get("ANTHROPIC_API_KEY")
+from aria_brain import (ANALYSIS_TOOL, cached_system_blocks, log_cache_usage,
+                        pick_model, pre_classify, read_analysis, save_email)
+from aria_db import connect_db, init_db
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await client.close()
+
+app = FastAPI(title="ARIA Email Agent", version="1.0", lifespan=lifespan)
+
+# Async client — awaiting Claude frees the event loop for other requests.
+# One shared keep-alive pool means TCP+TLS setup happens once, not per email;
+# HTTP/2 is used when the h2 package (httpx[http2]) is installed.
+client = anthropic.AsyncAnthropic(
+    api_key=os.environ.get("ANTHROPIC_API_KEY"),
+    http_client=anthropic.DefaultAsyncHttpxClient(
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+        timeout=httpx.Timeout(60.0)
+    )
 )
 
 ARIA_SYSTEM_PROMPT = """
@@ -32,8 +52,10 @@ Gabriela's context:
 Analyze each email deeply — understand context, intent, urgency.
 Be intelligent, not keyword-based. A polite email can still be a 5 
 if it contains a breach. URGENT in subject might be a 2 if it's sales.
+"""
 
-Respond ONLY with raw valid JSON — no markdown, no preamble:
+ARIA_OUTPUT_GUIDE = """
+Record your analysis with the emit_email_analysis tool, using these fields:
 
 {
 "category": "VENDOR_SECURITY|TEAM_MANAGEMENT|ESCALATION|MEETING_REQUEST|FYI_ONLY|NEWSLETTER|ADMIN|LEGAL|PROCUREMENT|FOLLOW_UP_NEEDED|SPAM", 
@@ -55,6 +77,8 @@ Urgency:
 1 = newsletters, auto-notifications, digests
 """
 
+ARIA_SYSTEM_BLOCKS = cached_system_blocks(ARIA_SYSTEM_PROMPT, ARIA_OUTPUT_GUIDE)
+
 # ─────────────────────────────────────────────────
 # MODELS
 # ─────────────────────────────────────────────────
@@ -71,52 +95,78 @@ class StatusUpdate(BaseModel):
     new_status: str
     notes: str = ""
 
+# ─────────────────────────────────────────────────
+# DATABASE
+# ─────────────────────────────────────────────────
+# Size to the number of requests FastAPI may serve concurrently.
+READER_POOL_SIZE = 4
+
+init_db()
+
+# One writer connection guarded by a lock plus a queue of reader connections,
+# opened on first use and kept for the life of the process.
+_writer = None
+_writer_lock = threading.Lock()
+_readers = queue.Queue()
+_pool_lock = threading.Lock()
+
+def _open_pool():
+    global _writer
+    with _pool_lock:
+        if _writer is not None:
+            return
+        for _ in range(READER_POOL_SIZE):
+            _readers.put(connect_db(check_same_thread=False))
+        _writer = connect_db(check_same_thread=False)
+
+@contextmanager
+def db_writer():
+    """
+    Exclusive use of the writer connection for one transaction. BEGIN
+    IMMEDIATE takes the WAL write lock up front, so a read-then-write
+    block like /status never has to upgrade its lock mid-transaction.
+    """
+    _open_pool()
+    with _writer_lock:
+        _writer.execute("BEGIN IMMEDIATE")
+        try:
+            yield _writer
+        except BaseException:
+            _writer.execute("ROLLBACK")
+            raise
+        _writer.execute("COMMIT")
+
+@contextmanager
+def db_reader():
+    _open_pool()
+    conn = _readers.get()
+    try:
+        yield conn
+    finally:
+        _readers.put(conn)
+
 # ─────────────────────────────────────────────────
 # HELPERS
 # ─────────────────────────────────────────────────
-def save_to_db(data: dict) -> int:
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    existing = cursor.execute(
-        "SELECT EmailID FROM ARIA_Emails WHERE Subject=? AND Sender=?",
-        (data["Subject"], data["Sender"])
-    ).fetchone()
-
-    if existing:
-        conn.close()
-        return -1
-
-    cursor.execute("""
-        INSERT INTO ARIA_Emails (
-            ThreadID, Sender, Subject, BodyPreview, ReceivedAt,
-            Category, Urgency, Summary, SuggestedAction,
-            DelegateTo, DraftReply, FollowUpDate, KeyEntities,
-            RequiresGabriela, Status
-        ) VALUES (
-            :ThreadID, :Sender, :Subject, :BodyPreview, :ReceivedAt,
-            :Category, :Urgency, :Summary, :SuggestedAction,
-            :DelegateTo, :DraftReply, :FollowUpDate, :KeyEntities,
-            :RequiresGabriela, :Status
-        )
-    """, data)
+def is_duplicate(subject: str, sender: str) -> bool:
+    with db_reader() as conn:
+        return conn.execute(
+            "SELECT 1 FROM ARIA_Emails WHERE Subject=? AND Sender=?",
+            (subject, sender)
+        ).fetchone() is not None
 
-    email_id = cursor.lastrowid or 0
+def save_to_db(data: dict) -> int:
+    with db_writer() as conn:
+        email_id = save_email(conn, data)
+        if email_id == -1:
+            return -1
 
-    if data.get("FollowUpDate"):
-        cursor.execute(
-            "INSERT INTO ARIA_FollowUps (EmailID, FollowUpDate) VALUES (?,?)",
-            (email_id, data["FollowUpDate"])
+        conn.execute(
+            "INSERT INTO ARIA_AuditLog (EmailID, Action, NewStatus) VALUES (?,?,?)",
+            (email_id, "CREATED", "PENDING")
         )
 
-    cursor.execute(
-        "INSERT INTO ARIA_AuditLog (EmailID, Action, NewStatus) VALUES (?,?,?)",
-        (email_id, "CREATED", "PENDING")
-    )
-
-    conn.commit()
-    conn.close()
-    return email_id
+        return email_id
 
 # ─────────────────────────────────────────────────
 # ROUTES
@@ -128,36 +178,38 @@ def health_check():
 @app.post("/analyze")
 async def analyze_email(email: EmailPayload):
     try:
-        prompt = f"""Analyze this email for Gabriela:
+        # Power Automate retries re-post the same email — answer those before
+        # spending a Claude call; the unique index still guards the insert
+        if await asyncio.to_thread(is_duplicate, email.subject, email.sender):
+            return {"status": "duplicate", "message": "Email already exists"}
+
+        # Obvious bulk mail (newsletters, digests, no-reply blasts) is settled
+        # by the rules engine; everything else goes to Claude
+        text = email.subject + " " + email.body
+        result = pre_classify(email.sender, email.subject, text)
 
-FROM: {email.sender}
+        if result is not None:
+            print(f"   ⚡ Rules engine: {email.subject[:50]} — no Claude call")
+        else:
+            prompt = f"""FROM: {email.sender}
 SUBJECT: {email.subject}
 RECEIVED: {email.received_at}
 BODY:
-{email.body}
-
-Return only the JSON analysis."""
-
-        message = client.messages.create(
-            model="claude-opus-4-6",
-            max_tokens=1500,
-            system=ARIA_SYSTEM_PROMPT,
-            messages=[{"role": "user", "content": prompt}]
-        )
-
-        # Extract text from the first content block
-        text_content = None
-        for block in message.content:
-            if block.type == "text":
-                text_content = block.text
-                break
-        
-        if not text_content:
-            raise ValueError("No text content in Claude response")
-        
-        raw = text_content.strip()
-        raw = raw.replace("```json", "").replace("```", "").strip()
-        result = json.loads(raw)
+{email.body}"""
+
+            model, max_tokens = pick_model(text)
+            print(f"   🧠 {model}: {email.subject[:50]}")
+            message = await client.messages.create(
+                model=model,
+                max_tokens=max_tokens,
+                system=ARIA_SYSTEM_BLOCKS,
+                tools=[ANALYSIS_TOOL],
+                tool_choice={"type": "tool", "name": ANALYSIS_TOOL["name"]},
+                messages=[{"role": "user", "content": prompt}]
+            )
+            log_cache_usage(message)
+
+            result = read_analysis(message, ANALYSIS_TOOL["name"])
 
         data = {
             "ThreadID":         email.thread_id or f"PA-{datetime.now().strftime('%Y%m%d%H%M%S')}",
@@ -172,12 +224,12 @@ Return only the JSON analysis."""
             "DelegateTo":       result.get("delegate_to"),
             "DraftReply":       result.get("draft_reply"),
             "FollowUpDate":     result.get("follow_up_date"),
-            "KeyEntities":      json.dumps(result.get("key_entities", [])),
+            "KeyEntities":      orjson.dumps(result.get("key_entities", [])).decode(),
             "RequiresGabriela": 1 if result.get("requires_gabriela") else 0,
             "Status":           "PENDING"
         }
 
-        email_id = save_to_db(data)
+        email_id = await asyncio.to_thread(save_to_db, data)
 
         if email_id == -1:
             return {"status": "duplicate", "message": "Email already exists"}
@@ -191,48 +243,44 @@ Return only the JSON analysis."""
             "summary":   data["Summary"]
         }
 
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=500, detail="Claude returned invalid JSON")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Plain def routes run in FastAPI's threadpool, so blocking SQLite calls
+# never stall the event loop.
 @app.post("/status")
-async def update_status(update: StatusUpdate):
+def update_status(update: StatusUpdate):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        old = conn.execute(
-            "SELECT Status FROM ARIA_Emails WHERE EmailID=?",
-            (update.email_id,)).fetchone()
-        old_status = old[0] if old else None
+        with db_writer() as conn:
+            old = conn.execute(
+                "SELECT Status FROM ARIA_Emails WHERE EmailID=?",
+                (update.email_id,)).fetchone()
+            old_status = old[0] if old else None
 
-        conn.execute(
-            "UPDATE ARIA_Emails SET Status=?, StatusUpdatedAt=?, Notes=? WHERE EmailID=?",
-            (update.new_status, datetime.now().isoformat(),
-            update.notes, update.email_id))
+            conn.execute(
+                "UPDATE ARIA_Emails SET Status=?, StatusUpdatedAt=?, Notes=? WHERE EmailID=?",
+                (update.new_status, datetime.now().isoformat(),
+                update.notes, update.email_id))
 
-        conn.execute(
-            "INSERT INTO ARIA_AuditLog (EmailID, Action, OldStatus, NewStatus) VALUES (?,?,?,?)",
-            (update.email_id, "STATUS_CHANGE", old_status, update.new_status))
+            conn.execute(
+                "INSERT INTO ARIA_AuditLog (EmailID, Action, OldStatus, NewStatus) VALUES (?,?,?,?)",
+                (update.email_id, "STATUS_CHANGE", old_status, update.new_status))
 
-        conn.commit()
-        conn.close()
         return {"status": "success", "email_id": update.email_id,
                 "new_status": update.new_status}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/pending")
-async def get_pending():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    rows = cursor.execute("""
-        SELECT EmailID, Sender, Subject, Category, Urgency,
-        Summary, SuggestedAction, RequiresGabriela
-        FROM ARIA_Emails
-        WHERE Status = 'PENDING'
-        ORDER BY Urgency DESC, ReceivedAt DESC
-    """).fetchall()
-    conn.close()
+def get_pending():
+    with db_reader() as conn:
+        rows = conn.execute("""
+            SELECT EmailID, Sender, Subject, Category, Urgency,
+            Summary, SuggestedAction, RequiresGabriela
+            FROM ARIA_Emails
+            WHERE Status = 'PENDING'
+            ORDER BY Urgency DESC, ReceivedAt DESC
+        """).fetchall()
     return {"count": len(rows), "emails": [
         {"id": r[0], "sender": r[1], "subject": r[2],
         "category": r[3], "urgency": r[4], "summary": r[5],
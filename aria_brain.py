@@ -3,12 +3,15 @@
 # Brain powered by Claude AI (Anthropic)
 
 import anthropic
+import hashlib
 import sqlite3
-import json
+import orjson
 import os
+import re
+from contextlib import contextmanager
 from datetime import datetime
 
-DB_PATH = r"C:\Users\MXDELACEGA\OneDrive - NESTLE\GitHub\ARIA-AI-Agent\aria.db"
+from aria_db import connect_db, init_db
 
 # ─────────────────────────────────────────────────
 # CLAUDE CLIENT
@@ -36,10 +39,14 @@ Gabriela's context:
 Your job is to analyze each email deeply — understand context, intent, 
 urgency, relationships, and what action truly serves Gabriela best.
 
-You must respond ONLY with a valid JSON object. No preamble, no explanation,
-no markdown — just raw JSON.
+Be intelligent — read between the lines. A politely worded email can still
+be a 5 if it contains a breach report. A subject saying URGENT might be 
+a 2 if it's just a sales email. Use judgment, not keywords.
+"""
 
-Return exactly this structure:
+ARIA_OUTPUT_GUIDE = """
+Record your analysis with the provided tool — one analysis per email,
+with exactly this structure:
 {
   "category": "one of: VENDOR_SECURITY | TEAM_MANAGEMENT | ESCALATION | MEETING_REQUEST | FYI_ONLY | NEWSLETTER | ADMIN | LEGAL | PROCUREMENT | FOLLOW_UP_NEEDED | SPAM",
   "urgency": "integer 1-5",
@@ -59,47 +66,162 @@ Urgency guide:
 3 = Needs Gabriela's review or input, vendor follow-ups, team decisions
 2 = FYI updates, informational, low priority requests
 1 = Newsletters, auto-notifications, digests, no-reply senders
-
-Be intelligent — read between the lines. A politely worded email can still
-be a 5 if it contains a breach report. A subject saying URGENT might be 
-a 2 if it's just a sales email. Use judgment, not keywords.
 """
 
+def cached_system_blocks(*texts: str) -> list:
+    """
+    Static prefix marked cacheable so Claude serves it from the prompt cache
+    on every call after the first. Each text (role/context, output guide) is
+    its own cached block; the email itself is the only dynamic content and
+    goes last, in the user turn.
+    """
+    return [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}
+            for text in texts]
+
+ARIA_SYSTEM_BLOCKS = cached_system_blocks(ARIA_SYSTEM_PROMPT, ARIA_OUTPUT_GUIDE)
+
+# Tool-use schema — forcing Claude to call the tool guarantees the analysis
+# comes back as structured input instead of free text that must be parsed.
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "category": {"type": "string", "enum": [
+            "VENDOR_SECURITY", "TEAM_MANAGEMENT", "ESCALATION", "MEETING_REQUEST",
+            "FYI_ONLY", "NEWSLETTER", "ADMIN", "LEGAL", "PROCUREMENT",
+            "FOLLOW_UP_NEEDED", "SPAM"]},
+        "urgency": {"type": "integer", "minimum": 1, "maximum": 5},
+        "summary": {"type": "string"},
+        "suggested_action": {"type": "string", "enum": [
+            "REPLY_NOW", "DELEGATE", "ARCHIVE", "SCHEDULE", "FOLLOW_UP", "DELETE"]},
+        "delegate_to": {"type": ["string", "null"]},
+        "draft_reply": {"type": ["string", "null"]},
+        "follow_up_date": {"type": ["string", "null"], "description": "YYYY-MM-DD"},
+        "key_entities": {"type": "array", "items": {"type": "string"}},
+        "requires_gabriela": {"type": "boolean"},
+        "reasoning": {"type": "string"}
+    },
+    "required": ["category", "urgency", "summary", "suggested_action", "delegate_to",
+                 "draft_reply", "follow_up_date", "key_entities",
+                 "requires_gabriela", "reasoning"]
+}
+
+ANALYSIS_TOOL = {
+    "name": "emit_email_analysis",
+    "description": "Record ARIA's analysis of the email.",
+    "input_schema": ANALYSIS_SCHEMA
+}
+
+# Batch items carry the number of their EMAIL n: block, so results are
+# matched to emails by number rather than by position in the reply
+BATCH_ITEM_SCHEMA = {
+    **ANALYSIS_SCHEMA,
+    "properties": {
+        "email_number": {"type": "integer", "minimum": 1,
+                         "description": "n from the EMAIL n: header being analyzed"},
+        **ANALYSIS_SCHEMA["properties"]
+    },
+    "required": ["email_number", *ANALYSIS_SCHEMA["required"]]
+}
+
+BATCH_ANALYSIS_TOOL = {
+    "name": "emit_email_analyses",
+    "description": "Record ARIA's analysis of every email in the batch, one per EMAIL n: block.",
+    "input_schema": {
+        "type": "object",
+        "properties": {"analyses": {"type": "array", "items": BATCH_ITEM_SCHEMA}},
+        "required": ["analyses"]
+    }
+}
+
 # ─────────────────────────────────────────────────
-# CORE ANALYSIS FUNCTION
+# MODEL ROUTING
 # ─────────────────────────────────────────────────
-def analyze_email(sender: str, subject: str, body: str,
-                  received_at: str, thread_id: str) -> dict:
-    
-    prompt = f"""Analyze this email for Gabriela:
+FAST_MODEL = "claude-haiku-4-5"
+DEEP_MODEL = "claude-opus-4-6"
+# Per email — tool output is just the analysis JSON, no prose around it
+FAST_MAX_TOKENS = 600
+DEEP_MAX_TOKENS = 800
+LONG_BODY_CHARS = 4000  # long threads go straight to the deep model
+
+BULK_SENDER_MARKERS = ("noreply", "no-reply", "donotreply", "do-not-reply",
+                       "newsletter", "digest", "mailer-daemon", "notifications@")
+BULK_BODY_MARKERS = ("unsubscribe", "manage your preferences", "manage preferences",
+                     "view this email in your browser", "view in browser")
+ESCALATION_KEYWORDS = ("breach", "incident", "critical", "overdue", "escalat",
+                       "non-compliance", "noncompliance", "legal", "deadline",
+                       "urgent", "immediately", "suspend", "terminat")
+
+# Each keyword table compiles to one case-insensitive alternation, so a check
+# is a single C-level regex scan with no lowercased copy of the email
+def _keyword_re(keywords: tuple) -> re.Pattern:
+    return re.compile("|".join(map(re.escape, keywords)), re.IGNORECASE)
+
+_BULK_SENDER_RE = _keyword_re(BULK_SENDER_MARKERS)
+_BULK_BODY_RE = _keyword_re(BULK_BODY_MARKERS)
+_ESCALATION_RE = _keyword_re(ESCALATION_KEYWORDS)
+
+def pre_classify(sender: str, subject: str, text: str):
+    """
+    Rules-engine verdict for obvious bulk mail, in the same shape as Claude's
+    JSON analysis so the caller can skip the API call. Returns None whenever
+    the email needs Claude's judgment. text is subject + " " + body, built
+    once by the caller and shared with pick_model.
+    """
+    if not _BULK_SENDER_RE.search(sender):
+        return None
 
-FROM: {sender}
-SUBJECT: {subject}
-RECEIVED: {received_at}
-BODY:
-{body}
+    if not _BULK_BODY_RE.search(text):
+        return None
+    if _ESCALATION_RE.search(text):
+        return None
 
-Return only the JSON analysis."""
+    return {
+        "category":          "NEWSLETTER",
+        "urgency":           1,
+        "summary":           f"Automated bulk mail from {sender}: {subject}",
+        "suggested_action":  "ARCHIVE",
+        "delegate_to":       None,
+        "draft_reply":       None,
+        "follow_up_date":    None,
+        "key_entities":      [],
+        "requires_gabriela": False,
+        "reasoning":         "Rules engine: bulk sender with unsubscribe footer and no escalation keywords."
+    }
 
-    message = client.messages.create(
-        model="claude-opus-4-6",
-        max_tokens=1500,
-        system=ARIA_SYSTEM_PROMPT,
-        messages=[{"role": "user", "content": prompt}]
-    )
+def pick_model(text: str) -> tuple:
+    """Haiku for routine triage; Opus when the email looks urgent or is long."""
+    if len(text) > LONG_BODY_CHARS or _ESCALATION_RE.search(text):
+        return DEEP_MODEL, DEEP_MAX_TOKENS
+    return FAST_MODEL, FAST_MAX_TOKENS
 
-    raw = message.content[0].text.strip()
-    
-    # Clean any accidental markdown
-    raw = raw.replace("```json", "").replace("```", "").strip()
-    result = json.loads(raw)
+# ─────────────────────────────────────────────────
+# CORE ANALYSIS FUNCTION
+# ─────────────────────────────────────────────────
+def log_cache_usage(message) -> None:
+    usage = message.usage
+    print(f"         ↳ 🗄️  Prompt cache — read: {getattr(usage, 'cache_read_input_tokens', 0) or 0} | "
+          f"written: {getattr(usage, 'cache_creation_input_tokens', 0) or 0} | "
+          f"uncached input: {usage.input_tokens}")
+
+def read_analysis(message, tool_name: str):
+    """Returns the input Claude passed to the (forced) analysis tool."""
+    if message.stop_reason == "max_tokens":
+        raise ValueError("Claude hit max_tokens before finishing the analysis")
 
+    for block in message.content:
+        if block.type == "tool_use" and block.name == tool_name:
+            return block.input
+
+    raise ValueError("No analysis in Claude response")
+
+def build_record(email: dict, result: dict) -> dict:
+    """Map Claude's JSON analysis of one email onto an ARIA_Emails row."""
     return {
-        "ThreadID":          thread_id,
-        "Sender":            sender,
-        "Subject":           subject,
-        "BodyPreview":       body[:500],
-        "ReceivedAt":        received_at,
+        "ThreadID":          email["thread_id"],
+        "Sender":            email["sender"],
+        "Subject":           email["subject"],
+        "BodyPreview":       email["body"][:500],
+        "ReceivedAt":        email["received_at"],
         "Category":          result.get("category", "ADMIN"),
         "Urgency":           int(result.get("urgency", 2)),
         "Summary":           result.get("summary", ""),
@@ -107,30 +229,127 @@ Return only the JSON analysis."""
         "DelegateTo":        result.get("delegate_to"),
         "DraftReply":        result.get("draft_reply"),
         "FollowUpDate":      result.get("follow_up_date"),
-        "KeyEntities":       json.dumps(result.get("key_entities", [])),
+        "KeyEntities":       orjson.dumps(result.get("key_entities", [])).decode(),
         "RequiresGabriela":  1 if result.get("requires_gabriela") else 0,
         "Status":            "PENDING",
         "Reasoning":         result.get("reasoning", "")
     }
 
+def analyze_email(sender: str, subject: str, body: str,
+                  received_at: str, thread_id: str) -> dict:
+    email = {
+        "sender": sender, "subject": subject, "body": body,
+        "received_at": received_at, "thread_id": thread_id
+    }
+
+    key = cache_key(sender, subject, body)
+    result = cached_analysis(key)
+    if result is not None:
+        return build_record(email, result)
+
+    prompt = f"""FROM: {sender}
+SUBJECT: {subject}
+RECEIVED: {received_at}
+BODY:
+{body}"""
+
+    model, max_tokens = pick_model(subject + " " + body)
+    message = client.messages.create(
+        model=model,
+        max_tokens=max_tokens,
+        system=ARIA_SYSTEM_BLOCKS,
+        tools=[ANALYSIS_TOOL],
+        tool_choice={"type": "tool", "name": ANALYSIS_TOOL["name"]},
+        messages=[{"role": "user", "content": prompt}]
+    )
+    log_cache_usage(message)
+
+    result = read_analysis(message, ANALYSIS_TOOL["name"])
+    store_analyses([(key, result)])
+
+    return build_record(email, result)
+
+def analyze_batch(emails: list, model: str = DEEP_MODEL,
+                  max_tokens: int = DEEP_MAX_TOKENS) -> list:
+    """
+    Analyzes several emails in a single Claude call — one round-trip and
+    one system-prompt prefill for the whole batch instead of one per email.
+    Returns Claude's analysis dict for each email, in the same order as
+    emails; raises ValueError unless every email got exactly one analysis.
+    """
+    parts = []
+    for n, email in enumerate(emails, 1):
+        parts.append(f"""EMAIL {n}:
+FROM: {email['sender']}
+SUBJECT: {email['subject']}
+RECEIVED: {email['received_at']}
+BODY:
+{email['body']}""")
+    prompt = "\n\n".join(parts)
+
+    message = client.messages.create(
+        model=model,
+        max_tokens=max_tokens * len(emails),
+        system=ARIA_SYSTEM_BLOCKS,
+        tools=[BATCH_ANALYSIS_TOOL],
+        tool_choice={"type": "tool", "name": BATCH_ANALYSIS_TOOL["name"]},
+        messages=[{"role": "user", "content": prompt}]
+    )
+    log_cache_usage(message)
+
+    results = read_analysis(message, BATCH_ANALYSIS_TOOL["name"]).get("analyses")
+
+    numbers = range(1, len(emails) + 1)
+    if not isinstance(results, list) or len(results) != len(emails):
+        raise ValueError(f"expected {len(emails)} analyses from Claude")
+    by_number = {result.pop("email_number", None): result for result in results}
+    if set(by_number) != set(numbers):
+        raise ValueError(f"Claude's analyses do not cover EMAIL 1-{len(emails)} exactly once")
+
+    return [by_number[n] for n in numbers]
+
 # ─────────────────────────────────────────────────
-# SAVE TO DATABASE
+# DATABASE
 # ─────────────────────────────────────────────────
-def save_email(data: dict) -> int:
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+init_db()
 
-    # Skip duplicates
-    existing = cursor.execute(
-        "SELECT EmailID FROM ARIA_Emails WHERE Subject=? AND Sender=?",
-        (data["Subject"], data["Sender"])
-    ).fetchone()
+# Bulk runs write many emails in a row — keep one connection open for all of them.
+_conn = None
 
-    if existing:
-        conn.close()
-        return -1
+def get_db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        _conn = connect_db()
+    return _conn
+
+@contextmanager
+def write_transaction():
+    """
+    One BEGIN IMMEDIATE ... COMMIT on the shared connection. Taking the write
+    lock up front means the commit never has to upgrade a read lock, and the
+    whole block costs a single fsync.
+    """
+    conn = get_db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+# ─────────────────────────────────────────────────
+# SAVE TO DATABASE
+# ─────────────────────────────────────────────────
+def save_email(conn: sqlite3.Connection, data: dict) -> int:
+    """
+    Inserts one analyzed email on conn — the caller owns the transaction
+    and writes the CREATED audit entries. Returns -1 for duplicates.
+    """
+    cursor = conn.cursor()
 
-    cursor.execute("""
+    # Duplicates hit the unique index and insert nothing
+    inserted = cursor.execute("""
         INSERT INTO ARIA_Emails (
             ThreadID, Sender, Subject, BodyPreview, ReceivedAt,
             Category, Urgency, Summary, SuggestedAction,
@@ -142,9 +361,14 @@ def save_email(data: dict) -> int:
             :DelegateTo, :DraftReply, :FollowUpDate, :KeyEntities,
             :RequiresGabriela, :Status
         )
-    """, data)
+        ON CONFLICT(Subject, Sender) DO NOTHING
+        RETURNING EmailID
+    """, data).fetchone()
+
+    if inserted is None:
+        return -1
 
-    email_id = cursor.lastrowid
+    email_id = inserted[0]
 
     if data.get("FollowUpDate"):
         cursor.execute(
@@ -152,19 +376,94 @@ def save_email(data: dict) -> int:
             (email_id, data["FollowUpDate"])
         )
 
-    # Audit log
-    cursor.execute(
-        "INSERT INTO ARIA_AuditLog (EmailID, Action, NewStatus) VALUES (?,?,?)",
-        (email_id, "CREATED", "PENDING")
-    )
-
-    conn.commit()
-    conn.close()
     return email_id
 
+# ─────────────────────────────────────────────────
+# RESPONSE CACHE
+# ─────────────────────────────────────────────────
+# Newsletters, digests and recurring vendor reminders arrive as near-identical
+# copies — reuse the earlier analysis instead of asking Claude again.
+CACHE_TTL_HOURS = 24
+_SUBJECT_PREFIX_RE = re.compile(r"^\s*((re|fw|fwd)\s*:\s*)+", re.IGNORECASE)
+
+def cache_key(sender: str, subject: str, body: str) -> str:
+    domain = sender.rsplit("@", 1)[-1].strip(" <>").lower()
+    normalized = " ".join(_SUBJECT_PREFIX_RE.sub("", subject).lower().split())
+    return hashlib.sha256(f"{domain}|{normalized}|{body[:2048]}".encode("utf-8")).hexdigest()
+
+def cached_analysis(key: str):
+    row = get_db().execute(
+        "SELECT Result FROM ARIA_ResponseCache WHERE CacheKey=? AND CreatedAt >= datetime('now', ?)",
+        (key, f"-{CACHE_TTL_HOURS} hours")
+    ).fetchone()
+    return orjson.loads(row[0]) if row else None
+
+def store_analyses(entries: list) -> None:
+    """Caches (key, analysis) pairs in a single transaction."""
+    with write_transaction() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO ARIA_ResponseCache (CacheKey, Result) VALUES (?,?)",
+            [(key, orjson.dumps(result).decode()) for key, result in entries]
+        )
+
 # ─────────────────────────────────────────────────
 # PROCESS FROM FILE (aria_response.txt)
 # ─────────────────────────────────────────────────
+BATCH_SIZE = 10  # emails per Claude call
+
+# Header lines before BODY: are picked up in one scan; everything after the
+# BODY: line is the body, even lines that happen to start with FROM: etc.
+_HEADER_RE = re.compile(r"^(FROM|SUBJECT|RECEIVED):(.*)$", re.MULTILINE)
+_BODY_RE = re.compile(r"^BODY:.*$\n?", re.MULTILINE)
+
+def parse_block(block: str) -> dict:
+    match = _BODY_RE.search(block)
+    head = block[:match.start()] if match else block
+    body = block[match.end():] if match else ""
+    headers = {key: value.strip() for key, value in _HEADER_RE.findall(head)}
+    return {
+        "sender":      headers.get("FROM", ""),
+        "subject":     headers.get("SUBJECT", ""),
+        "received_at": headers.get("RECEIVED"),
+        "body":        body.strip()
+    }
+
+def save_results(results: list, total: int) -> tuple:
+    """Saves (block number, record) pairs, printing a line per email."""
+    saved = 0
+    skipped = 0
+    created = []
+
+    # One transaction (and one commit fsync) for the whole group
+    with write_transaction() as conn:
+        for i, result in results:
+            print(f"   📧 [{i}/{total}] {result['Subject'][:50]}...")
+            try:
+                email_id = save_email(conn, result)
+            except Exception as e:
+                print(f"   ❌ Block {i} — Error: {e}")
+                continue
+
+            if email_id == -1:
+                print(f"         ↳ ⏭️  Duplicate skipped")
+                skipped += 1
+            else:
+                u = result['Urgency']
+                icon = "🔴" if u>=5 else "🟠" if u>=4 else "🟡" if u>=3 else "🔵"
+                print(f"         ↳ {icon} {result['Category']} | Urgency {u}/5 | {result['SuggestedAction']}")
+                print(f"         ↳ 💬 {result['Summary'][:80]}...")
+                if result.get('DraftReply'):
+                    print(f"         ↳ ✍️  Draft reply generated")
+                created.append((email_id, "CREATED", "PENDING"))
+                saved += 1
+
+        conn.executemany(
+            "INSERT INTO ARIA_AuditLog (EmailID, Action, NewStatus) VALUES (?,?,?)",
+            created
+        )
+
+    return saved, skipped
+
 def process_from_file():
     """
     Reads aria_response.txt — each email block separated by ---
@@ -189,62 +488,90 @@ def process_from_file():
     blocks = [b.strip() for b in content.split("---") if b.strip()]
     print(f"\n🧠 ARIA Brain — Processing {len(blocks)} emails with Claude AI\n" + "="*55)
 
-    saved = 0
-    skipped = 0
+    now = datetime.now()
+    now_iso = now.isoformat()
+    now_stamp = now.strftime('%Y%m%d%H%M%S')
 
+    emails = []
     for i, block in enumerate(blocks, 1):
-        try:
-            lines = block.split("\n")
-            sender   = ""
-            subject  = ""
-            received = datetime.now().isoformat()
-            body     = ""
-            in_body  = False
-
-            for line in lines:
-                if line.startswith("FROM:"):
-                    sender = line.replace("FROM:", "").strip()
-                elif line.startswith("SUBJECT:"):
-                    subject = line.replace("SUBJECT:", "").strip()
-                elif line.startswith("RECEIVED:"):
-                    received = line.replace("RECEIVED:", "").strip()
-                elif line.startswith("BODY:"):
-                    in_body = True
-                elif in_body:
-                    body += line + "\n"
-
-            if not sender or not subject:
-                print(f"   ⚠️  Block {i} skipped — missing FROM or SUBJECT")
-                continue
+        email = parse_block(block)
+
+        if not email["sender"] or not email["subject"]:
+            print(f"   ⚠️  Block {i} skipped — missing FROM or SUBJECT")
+            continue
+
+        email["received_at"] = email["received_at"] or now_iso
+        email["thread_id"] = f"ARIA-{now_stamp}-{i}"
+        emails.append((i, email))
+
+    # Repeats come from the response cache and obvious bulk mail is settled
+    # by rules; the rest is grouped by model for Claude
+    cached = []
+    local = []
+    queues = {}
+    for i, email in emails:
+        email["cache_key"] = cache_key(email["sender"], email["subject"], email["body"])
+        hit = cached_analysis(email["cache_key"])
+        if hit is not None:
+            cached.append((i, build_record(email, hit)))
+            continue
+
+        text = email["subject"] + " " + email["body"]
+        verdict = pre_classify(email["sender"], email["subject"], text)
+        if verdict:
+            local.append((i, build_record(email, verdict)))
+        else:
+            route = pick_model(text)
+            queues.setdefault(route, []).append((i, email))
 
-            print(f"   📧 [{i}/{len(blocks)}] Analyzing: {subject[:50]}...")
-
-            result = analyze_email(
-                sender=sender,
-                subject=subject,
-                body=body.strip(),
-                received_at=received,
-                thread_id=f"ARIA-{datetime.now().strftime('%Y%m%d%H%M%S')}-{i}"
-            )
-
-            email_id = save_email(result)
+    saved = 0
+    skipped = 0
 
-            if email_id == -1:
-                print(f"         ↳ ⏭️  Duplicate skipped")
-                skipped += 1
+    if cached:
+        print(f"   ♻️  {len(cached)} emails answered from the response cache — no Claude call")
+        new, dup = save_results(cached, len(blocks))
+        saved += new
+        skipped += dup
+
+    if local:
+        print(f"   ⚡ {len(local)} bulk emails triaged by rules — no Claude call")
+        new, dup = save_results(local, len(blocks))
+        saved += new
+        skipped += dup
+
+    for (model, max_tokens), queue in queues.items():
+        for start in range(0, len(queue), BATCH_SIZE):
+            batch = queue[start:start + BATCH_SIZE]
+            numbers = ", ".join(str(i) for i, _ in batch)
+            print(f"   📦 Analyzing blocks {numbers} with {model}...")
+
+            try:
+                results = analyze_batch([email for _, email in batch], model, max_tokens)
+            except Exception as e:
+                # One bad reply shouldn't cost the whole batch — retry each
+                # email on its own so only the ones that fail again are lost
+                print(f"   ⚠️  Blocks {numbers} — batch failed ({e}), analyzing one by one")
+                records = []
+                for i, email in batch:
+                    try:
+                        records.append((i, analyze_email(
+                            email["sender"], email["subject"], email["body"],
+                            email["received_at"], email["thread_id"])))
+                    except Exception as e:
+                        print(f"   ❌ Block {i} — Error: {e}")
             else:
-                u = result['Urgency']
-                icon = "🔴" if u>=5 else "🟠" if u>=4 else "🟡" if u>=3 else "🔵"
-                print(f"         ↳ {icon} {result['Category']} | Urgency {u}/5 | {result['SuggestedAction']}")
-                print(f"         ↳ 💬 {result['Summary'][:80]}...")
-                if result.get('DraftReply'):
-                    print(f"         ↳ ✍️  Draft reply generated")
-                saved += 1
-
-        except json.JSONDecodeError as e:
-            print(f"   ❌ Block {i} — Claude returned invalid JSON: {e}")
-        except Exception as e:
-            print(f"   ❌ Block {i} — Error: {e}")
+                store_analyses([(email["cache_key"], result)
+                                for (_, email), result in zip(batch, results)])
+                records = [(i, build_record(email, result))
+                           for (i, email), result in zip(batch, results)]
+
+            new, dup = save_results(records, len(blocks))
+            saved += new
+            skipped += dup
+
+    # Refresh planner statistics after a bulk load
+    if saved:
+        get_db().execute("ANALYZE")
 
     print(f"\n{'='*55}")
     print(f"✅ Complete: {saved} saved, {skipped} duplicates skipped")
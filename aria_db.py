@@ -0,0 +1,103 @@
+# aria_db.py
+# SQLite location, connection setup and schema additions shared by the
+# API, brain and parser
+
+import os
+import pathlib
+import sqlite3
+
+# Keep the database out of OneDrive — sync filters on every WAL/journal write
+# make each commit slow. Override with ARIA_DB_PATH.
+_LOCAL_APPDATA = os.environ.get("LOCALAPPDATA")
+DB_PATH = os.environ.get("ARIA_DB_PATH") or (
+    os.path.join(_LOCAL_APPDATA, "ARIA", "aria.db") if _LOCAL_APPDATA
+    else os.path.join(os.path.dirname(os.path.abspath(__file__)), "aria.db")
+)
+
+def open_db(**kwargs) -> sqlite3.Connection:
+    """
+    Opens the existing ARIA database read-write. mode=rw never creates the
+    file, so a wrong DB_PATH fails here instead of leaving an empty database
+    behind for the next run to trip over.
+    """
+    uri = pathlib.Path(DB_PATH).absolute().as_uri() + "?mode=rw"
+    try:
+        conn = sqlite3.connect(uri, uri=True, **kwargs)
+    except sqlite3.OperationalError as e:
+        raise sqlite3.OperationalError(
+            f"Cannot open the ARIA database at {DB_PATH} ({e}) — move the existing "
+            f"aria.db there or set ARIA_DB_PATH to its location"
+        ) from e
+
+    if conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='ARIA_Emails'"
+    ).fetchone() is None:
+        conn.close()
+        raise sqlite3.OperationalError(
+            f"{DB_PATH} has no ARIA tables — set ARIA_DB_PATH to the existing aria.db"
+        )
+    return conn
+
+# synchronous/cache/mmap settings are per-connection, so every connection
+# gets them; journal_mode=WAL is persistent and only needs setting once.
+SQLITE_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA wal_autocheckpoint=1000",
+)
+
+def connect_db(**kwargs) -> sqlite3.Connection:
+    # Autocommit mode by default — callers drive their own BEGIN/COMMIT
+    kwargs.setdefault("isolation_level", None)
+    conn = open_db(**kwargs)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+_initialized = False
+
+def init_db():
+    """Switch the database file to WAL and create the indexes and cache table."""
+    global _initialized
+    if _initialized:
+        return
+    conn = open_db()
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_emails_pending
+        ON ARIA_Emails(Status, Urgency DESC, ReceivedAt DESC)
+    """)
+    # Subject+Sender identifies an email; the unique index makes the
+    # duplicate check part of the INSERT itself. Rows saved before the index
+    # existed may repeat a pair — report it instead of failing on the CREATE;
+    # FollowUps and AuditLog point at EmailID, so nothing is deleted here.
+    if conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_emails_subject_sender'"
+    ).fetchone() is None:
+        dup = conn.execute("""
+            SELECT Subject, Sender FROM ARIA_Emails
+            GROUP BY Subject, Sender HAVING COUNT(*) > 1 LIMIT 1
+        """).fetchone()
+        if dup is not None:
+            conn.close()
+            raise sqlite3.OperationalError(
+                f"{DB_PATH} has more than one ARIA_Emails row for Subject={dup[0]!r}, "
+                f"Sender={dup[1]!r} — merge or delete the extra rows (and their "
+                f"ARIA_FollowUps/ARIA_AuditLog entries) so each Subject+Sender is "
+                f"unique, then start ARIA again"
+            )
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_emails_subject_sender
+        ON ARIA_Emails(Subject, Sender)
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ARIA_ResponseCache (
+            CacheKey        TEXT    PRIMARY KEY,
+            Result          TEXT    NOT NULL,
+            CreatedAt       TEXT    DEFAULT (datetime('now'))
+        )
+    """)
+    conn.close()
+    _initialized = True
@@ -2,113 +2,172 @@
 # Parses ARIA agent output into structured data and saves to SQLite
 
 import sqlite3
+import atexit
 import re
+import sys
 from datetime import datetime
-
-DB_PATH = r"C:\Users\MXDELACEGA\OneDrive - NESTLE\GitHub\ARIA-AI-Agent\aria.db"
+from functools import lru_cache
+from typing import Iterator
+
+from aria_db import connect_db, init_db
+
+# Compiled once at import instead of on every parse
+# Markdown link residue in one pass: "(https://...)" is dropped,
+# "[text]" is unwrapped to its text
+_CLEAN_RE = re.compile(r'\(https?://\S+\)|\[([^\]]+)\]')
+
+# Splits a block on the "KEY:" that starts a line, in one linear pass —
+# [prefix, key1, value1, key2, value2, ...]; a value runs up to the next KEY:
+_FIELD_SPLIT_RE = re.compile(r'^([A-Z_]+):', re.MULTILINE)
+
+def _clean(text: str) -> str:
+    return _CLEAN_RE.sub(lambda m: m.group(1) or '', text).strip()
+
+def _parse_int(raw, default: int) -> int:
+    # Check before converting — no exception on missing or non-numeric values.
+    # isdecimal, not isdigit: int() rejects digits like "²" that isdigit accepts
+    if raw and raw.removeprefix('-').isdecimal():
+        return int(raw)
+    return default
+
+# Repeated save_emails calls reuse one autocommit connection — closed at
+# interpreter exit; save_emails_iter drives its own BEGIN IMMEDIATE/COMMIT
+_conn = None
+
+def get_db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        _conn = connect_db(cached_statements=256)
+        atexit.register(_conn.close)
+    return _conn
+
+init_db()
+
+def _parse_block(block: str, index: int, now_stamp: str, now_iso: str) -> dict:
+    """Turn one EMAIL_START...EMAIL_END block into an ARIA_Emails row dict."""
+    block_s = block.strip()
+    fields = {}
+    parts = _FIELD_SPLIT_RE.split(block_s)
+    for key, val in zip(parts[1::2], parts[2::2]):
+        val = val.strip()
+        fields.setdefault(key, None if not val or val.upper() == "NONE" else val)
+
+    # Clean subject and sender — remove URLs, keep just the text/name
+    subject = _clean(fields.get("SUBJECT") or "No Subject")
+    sender = _clean(fields.get("FROM") or "Unknown")
+
+    urgency = _parse_int(fields.get("URGENCY"), 2)
+
+    requires = fields.get("REQUIRES_GABRIELA")
+    requires_flag = 1 if requires and requires.upper() == "YES" else 0
+
+    return {
+        "ThreadID":          f"ARIA-{now_stamp}-{index}",
+        "Sender":            sender,
+        "Subject":           subject,
+        "BodyPreview":       block_s[:500],
+        "ReceivedAt":        now_iso,
+        "Category":          fields.get("CATEGORY") or "ADMIN",
+        "Urgency":           urgency,
+        "Summary":           fields.get("SUMMARY") or "",
+        "SuggestedAction":   fields.get("ACTION") or "REPLY_NOW",
+        "DelegateTo":        fields.get("DELEGATE_TO"),
+        "DraftReply":        fields.get("DRAFT_REPLY"),
+        "FollowUpDate":      fields.get("FOLLOW_UP_DATE"),
+        "KeyEntities":       "[]",
+        "RequiresGabriela":  requires_flag,
+        "Status":            "PENDING"
+    }
 
 def parse_aria_response(raw_text: str) -> list:
     """
     Parses the structured EMAIL_START...EMAIL_END blocks
     from ARIA's Copilot response into a list of dicts.
     """
-    emails = []
-    blocks = re.findall(
-        r'EMAIL_START(.*?)EMAIL_END',
-        raw_text,
-        re.DOTALL
+    # Literal delimiters — plain string splitting, no regex scan needed.
+    # A block missing its EMAIL_END is dropped.
+    blocks = []
+    for piece in raw_text.split("EMAIL_START")[1:]:
+        block, sep, _ = piece.partition("EMAIL_END")
+        if sep:
+            blocks.append(block)
+
+    # One timestamp for the whole response — blocks stay apart by index
+    now = datetime.now()
+    now_iso = now.isoformat()
+    now_stamp = now.strftime('%Y%m%d%H%M%S')
+
+    return [_parse_block(block, i, now_stamp, now_iso) for i, block in enumerate(blocks)]
+
+_EMAIL_COLUMNS = (
+    "ThreadID", "Sender", "Subject", "BodyPreview", "ReceivedAt",
+    "Category", "Urgency", "Summary", "SuggestedAction",
+    "DelegateTo", "DraftReply", "FollowUpDate", "KeyEntities",
+    "RequiresGabriela", "Status",
+)
+_ROW_PLACEHOLDERS = "(" + ", ".join("?" * len(_EMAIL_COLUMNS)) + ")"
+
+# 15 parameters per row — 500 rows stays well under SQLite's variable limit
+INSERT_CHUNK = 500
+
+_FOLLOW_UP_SQL = "INSERT INTO ARIA_FollowUps (EmailID, FollowUpDate) VALUES (?, ?)"
+
+@lru_cache(maxsize=32)
+def _insert_sql(rows: int) -> str:
+    # Built once per row count and byte-identical on every call, so the
+    # connection's statement cache reuses the prepared statement
+    return (
+        f"INSERT INTO ARIA_Emails ({', '.join(_EMAIL_COLUMNS)}) "
+        f"VALUES {', '.join([_ROW_PLACEHOLDERS] * rows)} "
+        "ON CONFLICT(Subject, Sender) DO NOTHING "
+        "RETURNING EmailID, FollowUpDate, Subject, Sender"
     )
 
-    for block in blocks:
-        def extract(field):
-            pattern = rf'{field}:\s*(.+?)(?=\n[A-Z_]+:|$)'
-            match = re.search(pattern, block.strip(), re.DOTALL)
-            if match:
-                val = match.group(1).strip()
-                return None if val.upper() == "NONE" else val
-            return None
-
-        # Clean subject — remove URLs
-        subject_raw = extract("SUBJECT") or "No Subject"
-        subject = re.sub(r'\(https?://\S+\)', '', subject_raw).strip()
-        subject = re.sub(r'\[([^\]]+)\]', r'\1', subject).strip()
-
-        # Clean sender — extract just the name
-        sender_raw = extract("FROM") or "Unknown"
-        sender = re.sub(r'\(https?://\S+\)', '', sender_raw).strip()
-        sender = re.sub(r'\[([^\]]+)\]', r'\1', sender).strip()
-
-        urgency_raw = extract("URGENCY")
-        try:
-            urgency = int(urgency_raw) if urgency_raw else 2
-        except:
-            urgency = 2
-
-        requires = extract("REQUIRES_GABRIELA")
-        requires_flag = 1 if requires and requires.upper() == "YES" else 0
-
-        email_data = {
-            "ThreadID":          f"ARIA-{datetime.now().strftime('%Y%m%d%H%M%S')}-{len(emails)}",
-            "Sender":            sender,
-            "Subject":           subject,
-            "BodyPreview":       block.strip()[:500],
-            "ReceivedAt":        datetime.now().isoformat(),
-            "Category":          extract("CATEGORY") or "ADMIN",
-            "Urgency":           urgency,
-            "Summary":           extract("SUMMARY") or "",
-            "SuggestedAction":   extract("ACTION") or "REPLY_NOW",
-            "DelegateTo":        extract("DELEGATE_TO"),
-            "DraftReply":        extract("DRAFT_REPLY"),
-            "FollowUpDate":      extract("FOLLOW_UP_DATE"),
-            "KeyEntities":       "[]",
-            "RequiresGabriela":  requires_flag,
-            "Status":            "PENDING"
-        }
-        emails.append(email_data)
-
-    return emails
+def save_emails_iter(emails: list) -> Iterator[tuple[bool, dict]]:
+    """
+    Save parsed emails to SQLite, skip duplicates by Subject+Sender, then
+    yield (was_new, email) for each one in input order. The transaction is
+    committed before the first yield, so the caller never holds the lock.
+    """
+    cursor = get_db().cursor()
+
+    inserted = set()
+    follow_ups = []
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        # Multi-row INSERT per chunk — RETURNING hands back the ids of the rows
+        # actually inserted; duplicates (already stored or repeated in this
+        # response) hit the unique Subject+Sender index and return nothing
+        for i in range(0, len(emails), INSERT_CHUNK):
+            chunk = emails[i:i + INSERT_CHUNK]
+            params = [email[col] for email in chunk for col in _EMAIL_COLUMNS]
+            rows = cursor.execute(_insert_sql(len(chunk)), params).fetchall()
+            for email_id, follow_up, subject, sender in rows:
+                inserted.add((subject, sender))
+                if follow_up:
+                    follow_ups.append((email_id, follow_up))
+
+        cursor.executemany(_FOLLOW_UP_SQL, follow_ups)
+        cursor.execute("COMMIT")
+    except BaseException:
+        cursor.execute("ROLLBACK")
+        raise
+
+    # Rows go in VALUES order, so the first email with a given key is the
+    # inserted one and any repeat of it in this response is a duplicate
+    for email in emails:
+        key = (email["Subject"], email["Sender"])
+        was_new = key in inserted
+        inserted.discard(key)
+        yield was_new, email
 
 def save_emails(emails: list) -> int:
     """Save parsed emails to SQLite, skip duplicates by Subject+Sender."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    saved = 0
+    return sum(was_new for was_new, _ in save_emails_iter(emails))
 
-    for data in emails:
-        # Skip duplicates
-        existing = cursor.execute(
-            "SELECT EmailID FROM ARIA_Emails WHERE Subject=? AND Sender=?",
-            (data["Subject"], data["Sender"])
-        ).fetchone()
-
-        if existing:
-            continue
-
-        cursor.execute("""
-            INSERT INTO ARIA_Emails (
-                ThreadID, Sender, Subject, BodyPreview, ReceivedAt,
-                Category, Urgency, Summary, SuggestedAction,
-                DelegateTo, DraftReply, FollowUpDate, KeyEntities,
-                RequiresGabriela, Status
-            ) VALUES (
-                :ThreadID, :Sender, :Subject, :BodyPreview, :ReceivedAt,
-                :Category, :Urgency, :Summary, :SuggestedAction,
-                :DelegateTo, :DraftReply, :FollowUpDate, :KeyEntities,
-                :RequiresGabriela, :Status
-            )
-        """, data)
-
-        if data.get("FollowUpDate"):
-            email_id = cursor.lastrowid
-            cursor.execute(
-                "INSERT INTO ARIA_FollowUps (EmailID, FollowUpDate) VALUES (?,?)",
-                (email_id, data["FollowUpDate"])
-            )
-        saved += 1
-
-    conn.commit()
-    conn.close()
-    return saved
+# Indexed by urgency clamped to 0..5, and by the 0/1 RequiresGabriela flag
+_URGENCY_ICON = ("🔵", "🔵", "🔵", "🟡", "🟠", "🔴")
+_NEEDS_YOU = ("❌", "✅")
 
 def process_aria_output(raw_text: str):
     """Full pipeline: parse → save → report."""
@@ -120,15 +179,16 @@ def process_aria_output(raw_text: str):
         print("   ⚠️ No EMAIL_START/END blocks found. Check ARIA output format.")
         return
 
-    saved = save_emails(emails)
-    print(f"   ✅ Saved {saved} new emails to database ({len(emails)-saved} duplicates skipped)")
-
+    # Save and report in one pass over the emails
+    saved = 0
     print("\n📊 Summary:")
-    for e in emails:
-        u = e['Urgency']
-        icon = "🔴" if u>=5 else "🟠" if u>=4 else "🟡" if u>=3 else "🔵"
+    for was_new, e in save_emails_iter(emails):
+        saved += was_new
+        icon = _URGENCY_ICON[min(max(e['Urgency'], 0), 5)]
         print(f"   {icon} [{e['Category']}] {e['Subject'][:50]}")
-        print(f"      Action: {e['SuggestedAction']} | Needs You: {'✅' if e['RequiresGabriela'] else '❌'}")
+        print(f"      Action: {e['SuggestedAction']} | Needs You: {_NEEDS_YOU[e['RequiresGabriela']]}")
+
+    print(f"\n   ✅ Saved {saved} new emails to database ({len(emails)-saved} duplicates skipped)")
 
 # ─────────────────────────────────────────────────
 # MANUAL MODE — paste ARIA output directly here
@@ -137,14 +197,14 @@ if __name__ == "__main__":
     print("📋 Paste ARIA's full response below.")
     print("   When done, type END on a new line and press Enter:\n")
 
+    # Buffered stdin, lines keep their own newlines; EOF also ends input
     lines = []
-    while True:
-        line = input()
+    for line in sys.stdin:
         if line.strip() == "END":
             break
         lines.append(line)
 
-    raw = "\n".join(lines)
+    raw = "".join(lines)
     process_aria_output(raw)
     print("\n✅ Done! Open Streamlit dashboard to see results.")
 